@@ -0,0 +1,25 @@
+"""
+This module provides custom exceptions for the p2p module.
+"""
+
+
+class DeliveryError(Exception):
+    """
+    Exception raised when a message could not be delivered to a peer.
+
+    :param peer: The peer the message was sent to.
+    :type peer: Tuple[str, int]
+    :param seq: The sequence number of the message, or None if it was refused before getting one.
+    :type seq: int
+    :param reason: Why the delivery was abandoned.
+    :type reason: str
+    """
+
+    def __init__(self, peer, seq, reason):
+        self.peer = peer
+        self.seq = seq
+        self.reason = reason
+
+    def __str__(self):
+        message = "Message" if self.seq is None else f"Message {self.seq}"
+        return f"{message} to {self.peer[0]}:{self.peer[1]} was not delivered: {self.reason}."
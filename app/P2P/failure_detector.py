@@ -0,0 +1,146 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+class PhiAccrualFailureDetector:
+    """
+    Phi-accrual failure detector (Hayashibara et al.).
+
+    Instead of a binary alive/dead verdict the detector outputs a suspicion level ``phi`` for each peer, derived
+    from the distribution of the intervals between the heartbeats seen from that peer. A peer is considered failed
+    once ``phi`` exceeds ``threshold``.
+
+    Only periodic heartbeats may be passed to :meth:`heartbeat`, as bursty traffic would shrink the learned interval
+    and make every later pause look suspicious. Other evidence that the peer is alive goes to :meth:`seen`, which
+    delays suspicion without touching the interval history.
+
+    :param threshold: The phi value above which a peer is suspected (default is 8.0).
+    :type threshold: float
+    :param max_sample_size: The number of heartbeat intervals kept per peer (default is 100).
+    :type max_sample_size: int
+    :param min_std_deviation: The lower bound of the interval standard deviation, in seconds (default is 0.1).
+    :type min_std_deviation: float
+    :param acceptable_heartbeat_pause: Extra time, in seconds, tolerated before phi starts growing (default is 0.0).
+    :type acceptable_heartbeat_pause: float
+    :param first_heartbeat_estimate: The interval assumed, in seconds, before any interval was observed
+                                     (default is 1.0).
+    :type first_heartbeat_estimate: float
+    """
+
+    def __init__(
+        self,
+        threshold: float = 8.0,
+        max_sample_size: int = 100,
+        min_std_deviation: float = 0.1,
+        acceptable_heartbeat_pause: float = 0.0,
+        first_heartbeat_estimate: float = 1.0,
+    ):
+        self.threshold = threshold
+        self.max_sample_size = max_sample_size
+        self.min_std_deviation = min_std_deviation
+        self.acceptable_heartbeat_pause = acceptable_heartbeat_pause
+        self.first_heartbeat_estimate = first_heartbeat_estimate
+        self._last_heartbeat = {}
+        self._last_seen = {}
+        self._intervals = {}
+        self._lock = threading.Lock()
+
+    def heartbeat(self, peer, now: float = None) -> None:
+        """
+        Records a heartbeat from the specified peer.
+
+        :param peer: The peer the heartbeat was received from.
+        :type peer: Tuple[str, int]
+        :param now: The time of the heartbeat (default is the current time).
+        :type now: float
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            last = self._last_heartbeat.get(peer)
+            if last is None:
+                # Seed the history so the first real interval is not judged against nothing
+                estimate = self.first_heartbeat_estimate
+                self._intervals[peer] = deque(
+                    [estimate - estimate / 4, estimate + estimate / 4],
+                    maxlen=self.max_sample_size,
+                )
+            else:
+                self._intervals[peer].append(now - last)
+            self._last_heartbeat[peer] = now
+            self._last_seen[peer] = max(now, self._last_seen.get(peer, now))
+
+    def seen(self, peer, now: float = None) -> None:
+        """
+        Records non-heartbeat traffic from the specified peer. Does nothing if no heartbeat was ever recorded for it.
+
+        :param peer: The peer the traffic was exchanged with.
+        :type peer: Tuple[str, int]
+        :param now: The time of the traffic (default is the current time).
+        :type now: float
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if peer in self._last_seen:
+                self._last_seen[peer] = max(now, self._last_seen[peer])
+
+    def phi(self, peer, now: float = None) -> float:
+        """
+        Returns the suspicion level of the specified peer.
+
+        :param peer: The peer to compute phi for.
+        :type peer: Tuple[str, int]
+        :param now: The time at which phi is evaluated (default is the current time).
+        :type now: float
+        :return: The phi value of the peer, or 0.0 if no heartbeat was ever recorded for it.
+        :rtype: float
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            last = self._last_seen.get(peer)
+            if last is None:
+                return 0.0
+            intervals = self._intervals[peer]
+            mean = sum(intervals) / len(intervals)
+            variance = sum((i - mean) ** 2 for i in intervals) / len(intervals)
+
+        std_deviation = max(math.sqrt(variance), self.min_std_deviation)
+        mean += self.acceptable_heartbeat_pause
+        elapsed = now - last
+
+        # Logistic approximation of the normal CDF, accurate to within 0.01%. phi is -log10 of the tail
+        # probability e^z / (1 + e^z), evaluated in log space so long silences cannot underflow to log10(0).
+        y = (elapsed - mean) / std_deviation
+        z = -y * (1.5976 + 0.070566 * y * y)
+        if z < 0:
+            return (-z + math.log1p(math.exp(z))) / math.log(10)
+        return math.log1p(math.exp(-z)) / math.log(10)
+
+    def is_available(self, peer, now: float = None) -> bool:
+        """
+        Returns whether the specified peer is considered alive.
+
+        :param peer: The peer to check.
+        :type peer: Tuple[str, int]
+        :param now: The time at which the peer is checked (default is the current time).
+        :type now: float
+        :return: True if the phi value of the peer is below the threshold, False otherwise.
+        :rtype: bool
+        """
+        return self.phi(peer, now) < self.threshold
+
+    def remove(self, peer) -> None:
+        """
+        Forgets the heartbeat history of the specified peer.
+
+        :param peer: The peer to remove.
+        :type peer: Tuple[str, int]
+        """
+        with self._lock:
+            self._last_heartbeat.pop(peer, None)
+            self._last_seen.pop(peer, None)
+            self._intervals.pop(peer, None)
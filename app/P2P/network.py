@@ -2,18 +2,89 @@ import logging
 import socket
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from p2p.failure_detector import PhiAccrualFailureDetector
+from p2p.reliable import (
+    ReceiveWindow,
+    SendWindow,
+    broadcast_id,
+    format_ack,
+    format_origin,
+    format_sequence,
+    new_incarnation,
+    parse_ack,
+    parse_origin,
+    parse_sequence,
+)
+from p2p.tracing import Tracer, format_trace, parse_trace
+from utils import config
 
 # Configure logging
 logging.basicConfig(filename="p2p.log", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Peers started by setup share one hypergraph, so its mutations are serialised across all of them
+graph_lock = threading.Lock()
+
 
 class Peer:
-    def __init__(self, ip, port, peers):
+    def __init__(
+        self,
+        ip,
+        port,
+        peers,
+        graph=None,
+        connect_timeout=config.SOCKET_CONNECT_TIMEOUT,
+        io_timeout=config.SOCKET_IO_TIMEOUT,
+        heartbeat_interval=config.HEARTBEAT_INTERVAL,
+        phi_threshold=config.PHI_THRESHOLD,
+        acceptable_heartbeat_pause=None,
+        trace_sample_rate=config.TRACE_SAMPLE_RATE,
+        window_size=config.ACK_WINDOW_SIZE,
+    ):
         self.ip = ip
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Let a restarted node bind again while connections of its previous run are in TIME_WAIT
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.peers = peers
+        self.graph = graph
+        self.connect_timeout = connect_timeout
+        self.io_timeout = io_timeout
+        self.heartbeat_interval = heartbeat_interval
+        if acceptable_heartbeat_pause is None:
+            # Tolerate a few lost heartbeats, and at least one probe that ran into the I/O deadline
+            acceptable_heartbeat_pause = max(
+                3 * heartbeat_interval, io_timeout + heartbeat_interval
+            )
+        self.detector = PhiAccrualFailureDetector(
+            threshold=phi_threshold,
+            acceptable_heartbeat_pause=acceptable_heartbeat_pause,
+            first_heartbeat_estimate=heartbeat_interval,
+        )
+        # Peers are contacted concurrently so an unreachable one only delays itself
+        self.executor = ThreadPoolExecutor(max_workers=config.PEER_IO_WORKERS)
+        self.probing = set()
+        self.tracer = Tracer(
+            f"{ip}:{port}",
+            sample_rate=trace_sample_rate,
+            capacity=config.TRACE_BUFFER_SIZE,
+            export_dir=config.TRACE_EXPORT_DIR,
+            export_interval=config.TRACE_EXPORT_INTERVAL,
+        )
+        self.window_size = window_size
+        self.send_windows = {}
+        self.receive_windows = {}
+        self.flushing = set()
+        self.flush_pending = set()
+        # Broadcasts are told apart by origin address, incarnation and sequence number, a restarted
+        # node gets a new incarnation so its broadcasts are not mistaken for the previous run's
+        self.incarnation = new_incarnation()
+        self.broadcasts = 0
+        self.seen = OrderedDict()
+        self.stopped = threading.Event()
         self.message_timestamp = {}
         self.messages_sent = 0
         self.messages_received = 0
@@ -30,52 +101,92 @@ class Peer:
 
         logger.info(f"Node started on {self.ip}:{self.port}")
 
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        retransmit = threading.Thread(target=self._retransmit_loop, daemon=True)
+        retransmit.start()
+        self.tracer.start()
+
         while True:
-            client_socket, address = self.socket.accept()
-            logger.info(f"Connected to {address[0]}:{address[1]}")
+            try:
+                client_socket, _ = self.socket.accept()
+            except OSError:
+                if self.stopped.is_set():
+                    return
+                raise
 
             t = threading.Thread(target=self.handle_connection, args=(client_socket,))
             t.start()
 
+    def stop(self):
+        self.stopped.set()
+        # Closing alone does not wake a thread blocked in accept() on Linux, shutting down does
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.executor.shutdown(wait=False)
+        self.tracer.stop()
+
     def handle_connection(self, client_socket):
-        data = client_socket.recv(1024).decode().strip()
+        client_socket.settimeout(self.io_timeout)
+        try:
+            data = client_socket.recv(1024).decode().strip()
+        except OSError as e:
+            logger.error(f"Error reading from client socket: {e}")
+            client_socket.close()
+            return
 
         if data.startswith("CONNECT"):
             ip, port = data.split()[1:]
             self.connect(ip, int(port))
+        elif data.startswith("HEARTBEAT"):
+            ip, port = data.split()[1:]
+            if (ip, int(port)) in self.peers:
+                self.detector.seen((ip, int(port)))
+        elif data.startswith("ACK"):
+            self._handle_ack(data)
         elif data.startswith("MESSAGE"):
             self.message(data)
         client_socket.close()
 
     def message(self, data):
         message = data.split(" ", 1)[1].lstrip("MESSAGE ")
+        received_at = time.time()
         received_timestamp = float(message.split(",")[-1].split("=")[-1])
+        span = self.tracer.start_span(parse_trace(message))
+        sequence = parse_sequence(message)
+        origin = parse_origin(message)
         message = message.split(",")[0]
-        logger.info(f"timestamp={received_timestamp} - received message")
 
-        with self.lock:
-            for peer in self.peers:
-                peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                try:
-                    peer_socket.connect(peer)
-                    message_with_timestamp = (
-                        f"MESSAGE {message}, timestamp={received_timestamp}"
-                    )
+        sender = None
+        if sequence is not None:
+            sender, incarnation, seq, base = sequence
+            with self.lock:
+                window = self.receive_windows.get(sender)
+                # A new incarnation means the sender restarted its sequence numbers
+                if window is None or window.incarnation != incarnation:
+                    window = ReceiveWindow(incarnation, config.MAX_SELECTIVE_ACKS)
+                    self.receive_windows[sender] = window
+            is_new = window.on_data(seq, base)
+            # Always acknowledge, the previous acknowledgement of a duplicate may have been lost
+            self._send_ack(sender, window)
+            if not is_new:
+                return
 
-                    peer_socket.sendall(message_with_timestamp.encode())
+        # Unsequenced messages carry no broadcast id, they start a new broadcast from here
+        if origin is None:
+            origin = self._new_origin()
+        if not self._first_seen(origin):
+            return
 
-                    logger.info(
-                        f"timestamp={received_timestamp} - sent message to {peer}. metrics={self.get_metrics()}"
-                    )
-                    self.message_sent(message, peer)
-                except OSError as e:
-                    logger.error(f"Error connecting to peer {peer}: {e}")
-                except AttributeError:
-                    logger.error(f"Error closing peer socket: {peer_socket} is None")
-                finally:
-                    if peer_socket is not None:
-                        peer_socket.close()
+        self._broadcast(message, received_timestamp, span, origin, "forward", exclude=sender)
         self.messages_received += 1
+        if span is not None:
+            self.tracer.record(
+                "receive", span, received_at, time.time(), timestamp=received_timestamp
+            )
 
 
     def connect(self, ip, port):
@@ -90,13 +201,17 @@ class Peer:
 
     def _handle_connection(self, peer_socket, ip, port):
         try:
-            peer_socket.connect((ip, port))
+            self._connect_socket(peer_socket, (ip, port))
         except OSError as e:
             logger.error(f"Error connecting to peer {ip}:{port}: {e}")
             peer_socket.close()
             return
 
-        self.peers.append((ip, port))
+        with self.lock:
+            self.peers.append((ip, port))
+            # Whatever the peer sent before it was (re)added belongs to a previous session
+            self.receive_windows.pop((ip, port), None)
+        self.detector.heartbeat((ip, port))
 
         logger.info(f"Connected to peer {ip}:{port}")
 
@@ -115,32 +230,208 @@ class Peer:
 
     def send_message(self, message):
         timestamp = time.time()
+        span = self.tracer.start_trace()
+        origin = self._new_origin()
+        self._first_seen(origin)
+        futures = self._broadcast(message, timestamp, span, origin, "send")
+        if span is not None:
+            self.tracer.record("broadcast", span, timestamp, time.time(), message=message)
+        return futures
+
+    def _new_origin(self):
+        with self.lock:
+            self.broadcasts += 1
+            seq = self.broadcasts
+        return broadcast_id(self.ip, self.port, self.incarnation, seq)
 
+    def _first_seen(self, origin):
+        # Each broadcast is forwarded once, copies arriving over other links are dropped
         with self.lock:
-            for peer in self.peers:
-                peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                try:
-                    peer_socket.connect(peer)
-
-                    message_with_timestamp = f"MESSAGE {message}, timestamp={timestamp}"
-                    start_time = time.time()
-                    peer_socket.sendall(message_with_timestamp.encode())
-                    end_time = time.time()
-                    delay = end_time - start_time
-                    logger.info(
-                        f"Sent message, timestamp={timestamp}, delay={delay} to {peer}"
+            if origin in self.seen:
+                return False
+            self.seen[origin] = True
+            if len(self.seen) > config.SEEN_BROADCASTS:
+                self.seen.popitem(last=False)
+            return True
+
+    def _broadcast(self, message, timestamp, span, origin, kind, exclude=None):
+        # Returns a future per peer, resolved once that peer acknowledged the message.
+        # Submitting under the lock keeps remove_peer from failing a window between lookup and submit.
+        futures = {}
+        with self.lock:
+            peers = [peer for peer in self.peers if peer != exclude]
+            for peer in peers:
+                window = self.send_windows.get(peer)
+                if window is None:
+                    window = SendWindow(
+                        peer,
+                        window_size=self.window_size,
+                        initial_rto=config.RETRANSMIT_TIMEOUT,
+                        min_rto=config.MIN_RETRANSMIT_TIMEOUT,
+                        max_rto=config.MAX_RETRANSMIT_TIMEOUT,
+                        max_retransmits=config.MAX_RETRANSMITS,
+                        max_queued=config.SEND_QUEUE_SIZE,
                     )
-                    self.message_sent(message, peer)
-                except OSError as e:
-                    logger.error(f"Error connecting to peer {peer}: {e}")
-                except Exception as e:
-                    logger.error(f"Error sending message to peer {peer}: {e}")
-                else:
-                    logger.info(
-                        f"Message '{message}', timestamp={timestamp} sent to {peer}"
+                    self.send_windows[peer] = window
+                hop = self.tracer.start_span(span)
+                futures[peer] = window.submit((message, timestamp, origin, hop, kind))
+        for peer in peers:
+            self._schedule_flush(peer)
+        return futures
+
+    def _schedule_flush(self, peer):
+        # At most one flush per peer runs at a time, an unreachable peer only holds up its own messages.
+        # A request made while a flush runs is left pending for that flush to pick up before it ends.
+        with self.lock:
+            self.flush_pending.add(peer)
+            if peer in self.flushing:
+                return
+            self.flushing.add(peer)
+        try:
+            self.executor.submit(self._flush, peer)
+        except RuntimeError:
+            # The executor was shut down by stop()
+            with self.lock:
+                self.flushing.discard(peer)
+                self.flush_pending.discard(peer)
+
+    def _flush(self, peer):
+        # Transmits whatever the send window allows: new messages inside the window and expired retransmissions
+        while True:
+            with self.lock:
+                self.flush_pending.discard(peer)
+            try:
+                window = self.send_windows.get(peer)
+                while window is not None and self._transmit(peer, window):
+                    pass
+            except Exception:
+                logger.exception(f"Error flushing messages to peer {peer}")
+            with self.lock:
+                if peer not in self.flush_pending:
+                    self.flushing.discard(peer)
+                    return
+
+    def _transmit(self, peer, window):
+        # Sends one batch of messages, returns whether the caller should look for more
+        batch = window.sendable()
+        for i, (seq, base, (message, timestamp, origin, hop, kind), attempt) in enumerate(batch):
+            # Every retransmission gets its own span, so span ids stay unique in the trace
+            span = hop if attempt == 1 else self.tracer.start_span(hop)
+            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                start_time = time.time()
+                self._connect_socket(peer_socket, peer)
+                message_with_timestamp = (
+                    f"MESSAGE {message}{format_trace(span)}{format_origin(origin)}"
+                    f"{format_sequence(self.ip, self.port, window.incarnation, seq, base)}"
+                    f", timestamp={timestamp}"
+                )
+                peer_socket.sendall(message_with_timestamp.encode())
+                # Unsampled messages skip building the span arguments altogether
+                if span is not None:
+                    self.tracer.record(
+                        kind if attempt == 1 else "retransmit",
+                        span,
+                        start_time,
+                        time.time(),
+                        peer=f"{peer[0]}:{peer[1]}",
+                        seq=seq,
+                        attempt=attempt,
                     )
-                finally:
-                    peer_socket.close()
+                self.detector.seen(peer)
+                if attempt == 1:
+                    with self.lock:
+                        self.message_sent(message, peer)
+            except OSError as e:
+                logger.error(f"Error sending message {seq} to peer {peer}: {e}")
+                # This message waits for its timer, the rest of the batch never left and is tried again next time
+                window.disarm(seq for seq, *_ in batch[i + 1:])
+                return False
+            finally:
+                peer_socket.close()
+        return bool(batch)
+
+    def _send_ack(self, sender, window):
+        cumulative, selective = window.ack()
+        peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self._connect_socket(peer_socket, sender)
+            peer_socket.sendall(
+                format_ack(self.ip, self.port, window.incarnation, cumulative, selective).encode()
+            )
+        except OSError as e:
+            logger.warning(f"Error acknowledging messages from {sender}: {e}")
+        finally:
+            peer_socket.close()
+
+    def _handle_ack(self, data):
+        peer, incarnation, cumulative, selective = parse_ack(data)
+        window = self.send_windows.get(peer)
+        # Acknowledgements for an earlier window towards the same peer say nothing about this one
+        if window is None or window.incarnation != incarnation:
+            return
+        if window.on_ack(cumulative, selective):
+            self.detector.seen(peer)
+            # Acknowledgements slide the window open, send what was waiting
+            self._schedule_flush(peer)
+
+    def _retransmit_loop(self):
+        while not self.stopped.wait(config.RETRANSMIT_INTERVAL):
+            try:
+                for peer in list(self.send_windows):
+                    self._schedule_flush(peer)
+            except Exception:
+                logger.exception(f"Error in retransmit loop of {self.ip}:{self.port}")
+
+    def _connect_socket(self, peer_socket, peer):
+        # Bound the connect by its own deadline, then every later read/write by the I/O one
+        peer_socket.settimeout(self.connect_timeout)
+        peer_socket.connect(peer)
+        peer_socket.settimeout(self.io_timeout)
+
+    def _heartbeat_loop(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            try:
+                with self.lock:
+                    peers = list(self.peers)
+                for peer in peers:
+                    # Don't queue another probe behind one still waiting on a black-holed peer
+                    if peer not in self.probing:
+                        self.probing.add(peer)
+                        self.executor.submit(self._probe, peer)
+                for peer in peers:
+                    if not self.detector.is_available(peer):
+                        self.remove_peer(peer)
+            except Exception:
+                logger.exception(f"Error in heartbeat loop of {self.ip}:{self.port}")
+
+    def _probe(self, peer):
+        peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self._connect_socket(peer_socket, peer)
+            peer_socket.sendall(f"HEARTBEAT {self.ip} {self.port}".encode())
+            self.detector.heartbeat(peer)
+        except OSError as e:
+            logger.warning(f"Missed heartbeat to peer {peer}: {e}")
+        finally:
+            peer_socket.close()
+            self.probing.discard(peer)
+
+    def remove_peer(self, peer):
+        # The hypergraph is shared by every Peer created by setup, so a peer suspected here
+        # disappears from the graph of the whole network, not only from this node's view.
+        with self.lock:
+            if peer in self.peers:
+                self.peers.remove(peer)
+            window = self.send_windows.pop(peer, None)
+            self.receive_windows.pop(peer, None)
+        if self.graph is not None:
+            with graph_lock:
+                self.graph.remove_node(f"{peer[0]}:{peer[1]}")
+        self.detector.remove(peer)
+        if window is not None:
+            window.fail("peer suspected to have failed")
+        logger.warning(f"Removed suspected peer {peer[0]}:{peer[1]}")
 
 
     def message_sent(self, message, peer):
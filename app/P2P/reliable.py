@@ -0,0 +1,402 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from ._exceptions import DeliveryError
+
+
+def new_incarnation():
+    """
+    Returns a random incarnation id.
+
+    Incarnation ids tell apart the sequence number spaces of successive send windows towards the same address, e.g.
+    after a peer was removed and connected again, or after a node restarted. They are drawn from the OS so that nodes
+    seeding the ``random`` module identically still get distinct ids.
+
+    :return: An 8 hexadecimal digits id.
+    :rtype: str
+    """
+    return os.urandom(4).hex()
+
+
+def broadcast_id(ip, port, incarnation, seq):
+    """
+    Returns the id of a broadcast, which stays the same across all the hops it takes.
+
+    :param ip: The IP address of the node that started the broadcast.
+    :type ip: str
+    :param port: The port of the node that started the broadcast.
+    :type port: int
+    :param incarnation: The incarnation id of the node that started the broadcast.
+    :type incarnation: str
+    :param seq: The broadcast sequence number of that node.
+    :type seq: int
+    :return: The ``<ip>:<port>:<incarnation>:<seq>`` broadcast id.
+    :rtype: str
+    """
+    return f"{ip}:{port}:{incarnation}:{seq}"
+
+
+def format_origin(origin):
+    """
+    Returns the wire field carrying the id of a broadcast.
+
+    :param origin: The broadcast id created by :func:`broadcast_id`.
+    :type origin: str
+    :return: The ``, origin=<broadcast id>`` field.
+    :rtype: str
+    """
+    return f", origin={origin}"
+
+
+def parse_origin(message):
+    """
+    Extracts the broadcast id carried in a message.
+
+    :param message: The message payload, as comma separated fields.
+    :type message: str
+    :return: The ``<ip>:<port>:<incarnation>:<seq>`` broadcast id, or None if the message carries none.
+    :rtype: Union[str, None]
+    """
+    for field in message.split(",")[1:]:
+        field = field.strip()
+        if field.startswith("origin="):
+            return field[len("origin="):]
+    return None
+
+
+def format_sequence(ip, port, incarnation, seq, base):
+    """
+    Returns the wire fields carrying the sequence number of a message.
+
+    :param ip: The IP address acknowledgements must be sent to.
+    :type ip: str
+    :param port: The port acknowledgements must be sent to.
+    :type port: int
+    :param incarnation: The incarnation id of the send window the sequence number belongs to.
+    :type incarnation: str
+    :param seq: The sequence number of the message.
+    :type seq: int
+    :param base: The lowest sequence number the sender still retransmits.
+    :type base: int
+    :return: The ``, from=<ip>:<port>:<incarnation>, seq=<seq>, base=<base>`` fields.
+    :rtype: str
+    """
+    return f", from={ip}:{port}:{incarnation}, seq={seq}, base={base}"
+
+
+def parse_sequence(message):
+    """
+    Extracts the sequence fields carried in a message.
+
+    :param message: The message payload, as comma separated fields.
+    :type message: str
+    :return: A ``(sender, incarnation, seq, base)`` tuple, or None if the message is not sequenced.
+    :rtype: Union[Tuple[Tuple[str, int], str, int, int], None]
+    """
+    fields = {}
+    for field in message.split(",")[1:]:
+        key, _, value = field.strip().partition("=")
+        fields[key] = value
+    if "seq" not in fields:
+        return None
+    ip, port, incarnation = fields["from"].split(":")
+    return (ip, int(port)), incarnation, int(fields["seq"]), int(fields["base"])
+
+
+def format_ack(ip, port, incarnation, cumulative, selective):
+    """
+    Returns an acknowledgement message.
+
+    :param ip: The IP address of the acknowledging node.
+    :type ip: str
+    :param port: The port of the acknowledging node.
+    :type port: int
+    :param incarnation: The incarnation id of the send window being acknowledged.
+    :type incarnation: str
+    :param cumulative: The highest sequence number up to which everything was received.
+    :type cumulative: int
+    :param selective: The sequence numbers received above ``cumulative``.
+    :type selective: List[int]
+    :return: The ``ACK <ip> <port> <incarnation> <cumulative> <selective>`` message.
+    :rtype: str
+    """
+    sacks = ",".join(str(seq) for seq in selective) or "-"
+    return f"ACK {ip} {port} {incarnation} {cumulative} {sacks}"
+
+
+def parse_ack(data):
+    """
+    Parses an acknowledgement message.
+
+    :param data: The message created by :func:`format_ack`.
+    :type data: str
+    :return: A ``(peer, incarnation, cumulative, selective)`` tuple.
+    :rtype: Tuple[Tuple[str, int], str, int, Set[int]]
+    """
+    ip, port, incarnation, cumulative, sacks = data.split()[1:]
+    selective = set() if sacks == "-" else {int(seq) for seq in sacks.split(",")}
+    return (ip, int(port)), incarnation, int(cumulative), selective
+
+
+class _Outstanding:
+    def __init__(self, data, future):
+        self.data = data
+        self.future = future
+        self.attempts = 0
+        self.first_sent = None
+        self.deadline = None
+        self.skipped = 0
+
+
+class SendWindow:
+    """
+    Sliding send window towards a single peer.
+
+    Messages get consecutive sequence numbers and at most ``window_size`` of them, counted from the oldest
+    unacknowledged one, are in flight at a time. Each message has its own retransmission timer, derived from the
+    smoothed round-trip time (RFC 6298) and doubled on every retry. Selectively acknowledged messages are never
+    resent, and a message overtaken by three acknowledgements of later ones is resent without waiting for its timer.
+
+    Each window has its own random ``incarnation`` id, carried with its sequence numbers and echoed in the
+    acknowledgements, so that a window created later towards the same peer starts a fresh sequence number space.
+
+    :param peer: The peer the window sends to.
+    :type peer: Tuple[str, int]
+    :param window_size: The maximum number of unacknowledged messages in flight (default is 64).
+    :type window_size: int
+    :param initial_rto: The retransmission timeout, in seconds, before any round trip was measured (default is 1.0).
+    :type initial_rto: float
+    :param min_rto: The lower bound of the retransmission timeout, in seconds (default is 0.2).
+    :type min_rto: float
+    :param max_rto: The upper bound of the retransmission timeout, in seconds (default is 10.0).
+    :type max_rto: float
+    :param max_retransmits: The number of retransmissions after which a message is abandoned (default is 8).
+    :type max_retransmits: int
+    :param max_queued: The maximum number of unacknowledged messages, in flight or waiting (default is 1024).
+    :type max_queued: int
+    """
+
+    def __init__(
+        self,
+        peer,
+        window_size: int = 64,
+        initial_rto: float = 1.0,
+        min_rto: float = 0.2,
+        max_rto: float = 10.0,
+        max_retransmits: int = 8,
+        max_queued: int = 1024,
+    ):
+        self.peer = peer
+        self.incarnation = new_incarnation()
+        self.window_size = window_size
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_retransmits = max_retransmits
+        self.max_queued = max_queued
+        self.closed = False
+        self.rto = initial_rto
+        self.srtt = None
+        self.rttvar = None
+        self.next_seq = 1
+        self.outstanding = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base(self) -> int:
+        """
+        The lowest sequence number that is still unacknowledged.
+        """
+        # Sequence numbers are inserted in increasing order, so the first key is the lowest
+        return next(iter(self.outstanding), self.next_seq)
+
+    def submit(self, data) -> Future:
+        """
+        Queues a message for delivery.
+
+        :param data: The message, handed back by :meth:`sendable` whenever it has to be (re)transmitted.
+        :type data: Any
+        :return: A future resolved with the sequence number of the message once it is acknowledged, or failed with a
+                 :class:`DeliveryError` once it is abandoned. The future fails straight away if the window was
+                 closed by :meth:`fail` or already holds ``max_queued`` messages.
+        :rtype: Future
+        """
+        future = Future()
+        with self._lock:
+            if self.closed:
+                reason = "send window closed"
+            elif len(self.outstanding) >= self.max_queued:
+                reason = "send queue full"
+            else:
+                self.outstanding[self.next_seq] = _Outstanding(data, future)
+                self.next_seq += 1
+                return future
+        future.set_exception(DeliveryError(self.peer, None, reason))
+        return future
+
+    def sendable(self, now: float = None) -> list:
+        """
+        Returns the messages that must be transmitted now and arms their retransmission timers.
+
+        :param now: The current time (default is the current monotonic time).
+        :type now: float
+        :return: A list of ``(seq, base, data, attempt)`` tuples, ``attempt`` being 1 for the first transmission.
+        :rtype: List[Tuple[int, int, Any, int]]
+        """
+        if now is None:
+            now = time.monotonic()
+        sendable = []
+        abandoned = []
+        with self._lock:
+            for seq in list(self.outstanding):
+                entry = self.outstanding[seq]
+                if entry.deadline is not None and entry.deadline > now:
+                    continue
+                if entry.attempts > self.max_retransmits:
+                    del self.outstanding[seq]
+                    abandoned.append((seq, entry))
+                    continue
+                # Checked after abandoning, which may have moved the base forward
+                if seq >= self.base + self.window_size:
+                    break
+                entry.attempts += 1
+                if entry.first_sent is None:
+                    entry.first_sent = now
+                entry.deadline = now + min(self.rto * 2 ** (entry.attempts - 1), self.max_rto)
+                sendable.append((seq, entry.data, entry.attempts))
+            base = self.base
+        for seq, entry in abandoned:
+            entry.future.set_exception(
+                DeliveryError(self.peer, seq, f"no acknowledgement after {entry.attempts} attempts")
+            )
+        return [(seq, base, data, attempt) for seq, data, attempt in sendable]
+
+    def on_ack(self, cumulative: int, selective, now: float = None) -> int:
+        """
+        Processes an acknowledgement from the peer.
+
+        :param cumulative: The highest sequence number up to which the peer received everything.
+        :type cumulative: int
+        :param selective: The sequence numbers the peer received above ``cumulative``.
+        :type selective: Set[int]
+        :param now: The current time (default is the current monotonic time).
+        :type now: float
+        :return: The number of messages newly acknowledged.
+        :rtype: int
+        """
+        if now is None:
+            now = time.monotonic()
+        acked = []
+        with self._lock:
+            for seq in list(self.outstanding):
+                if seq <= cumulative or seq in selective:
+                    entry = self.outstanding.pop(seq)
+                    # Karn's algorithm: retransmitted messages give ambiguous round trips
+                    if entry.attempts == 1:
+                        self._sample_rtt(now - entry.first_sent)
+                    acked.append((seq, entry))
+            highest = max(selective, default=cumulative)
+            for seq, entry in self.outstanding.items():
+                if seq >= highest:
+                    break
+                if entry.first_sent is not None:
+                    entry.skipped += 1
+                    # Only once per message, later losses are left to the timer
+                    if entry.skipped == 3:
+                        entry.deadline = now
+        for seq, entry in acked:
+            entry.future.set_result(seq)
+        return len(acked)
+
+    def disarm(self, seqs) -> None:
+        """
+        Undoes :meth:`sendable` for messages of a batch that were never transmitted, e.g. because sending an earlier
+        message of the batch failed. They become sendable again straight away and the attempt is not counted.
+
+        :param seqs: The sequence numbers of the messages that were not transmitted.
+        :type seqs: Iterable[int]
+        """
+        with self._lock:
+            for seq in seqs:
+                entry = self.outstanding.get(seq)
+                if entry is None or entry.attempts == 0:
+                    continue
+                entry.attempts -= 1
+                entry.deadline = None
+                if entry.attempts == 0:
+                    entry.first_sent = None
+
+    def fail(self, reason: str) -> None:
+        """
+        Abandons every outstanding message and closes the window, later submissions fail straight away.
+
+        :param reason: Why the messages are abandoned.
+        :type reason: str
+        """
+        with self._lock:
+            self.closed = True
+            outstanding = self.outstanding
+            self.outstanding = {}
+        for seq, entry in outstanding.items():
+            entry.future.set_exception(DeliveryError(self.peer, seq, reason))
+
+    def _sample_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), self.max_rto)
+
+
+class ReceiveWindow:
+    """
+    Tracks the sequence numbers received from a single peer to acknowledge them and drop duplicates.
+
+    :param incarnation: The incarnation id of the remote send window.
+    :type incarnation: str
+    :param max_selective: The maximum number of selective acknowledgements reported (default is 32).
+    :type max_selective: int
+    """
+
+    def __init__(self, incarnation: str, max_selective: int = 32):
+        self.incarnation = incarnation
+        self.max_selective = max_selective
+        self.cumulative = 0
+        self.received = set()
+        self._lock = threading.Lock()
+
+    def on_data(self, seq: int, base: int) -> bool:
+        """
+        Records a received message.
+
+        :param seq: The sequence number of the message.
+        :type seq: int
+        :param base: The lowest sequence number the sender still retransmits; anything below it was abandoned.
+        :type base: int
+        :return: True if the message is new, False if it is a duplicate.
+        :rtype: bool
+        """
+        with self._lock:
+            if base - 1 > self.cumulative:
+                self.cumulative = base - 1
+                self.received = {s for s in self.received if s > self.cumulative}
+            if seq <= self.cumulative or seq in self.received:
+                return False
+            self.received.add(seq)
+            while self.cumulative + 1 in self.received:
+                self.cumulative += 1
+                self.received.remove(self.cumulative)
+            return True
+
+    def ack(self):
+        """
+        Returns the acknowledgement to send back.
+
+        :return: A ``(cumulative, selective)`` tuple.
+        :rtype: Tuple[int, List[int]]
+        """
+        with self._lock:
+            return self.cumulative, sorted(self.received)[: self.max_selective]
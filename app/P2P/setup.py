@@ -3,8 +3,10 @@ import random
 import threading
 import time
 import sys
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from hypergraph.algorithms import shortest_path
 from hypergraph.graph import Graph
+from p2p._exceptions import DeliveryError
 from p2p.network import Peer
 from utils import config
 
@@ -60,7 +62,7 @@ def create_routing_table(network):
 def start_nodes(network):
     # Create nodes and start threads
     nodes = [
-        Peer(node.name.split(":")[0], int(node.name.split(":")[1]), [])
+        Peer(node.name.split(":")[0], int(node.name.split(":")[1]), [], graph=network)
         for node in network.nodes
     ]
     threads = [threading.Thread(target=node.start) for node in nodes]
@@ -88,34 +90,28 @@ def send_messages(nodes, message, logger, start_time):
     target_nodes = nodes[1:]  # All other nodes are the target nodes
     traversal_time = 0
 
-    for node in target_nodes:
-        start_node.send_message(f"{message}")
-        logger.info(
-            f"Sent message from {start_node.ip}:{start_node.port} to {node.ip}:{node.port}"
-        )
-        while not node.message_timestamp:  # Wait for the message to arrive
-            if time.time() - start_time > 10:  # Add timeout of 10 seconds
-                logger.error(f"Message not received by {node.ip}:{node.port}")
-                break
-        if node.message_timestamp:
-            logger.info(f"Message received by {node.ip}:{node.port}")
-            if 0 in node.message_timestamp:
-                # Remove the message from the node's message queue
-                node.message_timestamp.pop(0)
-            else:
-                logger.error(
-                    f"Key 0 not found in message_timestamp for {node.ip}:{node.port}"
-                )
-            end_time = time.time()
-
-            # Calculate traversal time
-            traversal_time = end_time - start_time
-            logger.info(f"Traversal time: {traversal_time:.6f}s")
-            break  # Exit the loop once we get the traversal time
+    futures = start_node.send_message(f"{message}")
+    logger.info(f"Sent message from {start_node.ip}:{start_node.port}")
 
-        # Return traversal time if it is not zero
-        if traversal_time > 0:
-            return traversal_time
+    for node in target_nodes:
+        future = futures.get((node.ip, node.port))
+        if future is None:
+            logger.error(
+                f"{node.ip}:{node.port} is not a peer of {start_node.ip}:{start_node.port}"
+            )
+            continue
+        try:
+            # Wait for the acknowledgement, with a timeout of 10 seconds overall
+            future.result(timeout=max(0, 10 - (time.time() - start_time)))
+        except (FutureTimeoutError, DeliveryError) as e:
+            logger.error(f"Message not received by {node.ip}:{node.port}: {e}")
+            continue
+        logger.info(f"Message received by {node.ip}:{node.port}")
+        end_time = time.time()
+
+        # Calculate traversal time, i.e. until the last target acknowledged the message
+        traversal_time = end_time - start_time
+        logger.info(f"Traversal time: {traversal_time:.6f}s")
 
     # Return traversal time even if it is zero
     return traversal_time
@@ -155,7 +151,7 @@ def run():
     print(f'\nTraversal time: {traversal_time:.4f}s\n')
     logging.shutdown()
     for node in nodes:
-        node.socket.close()
+        node.stop()
 
     # Stop the program if the traversal time is not zero
     if traversal_time:
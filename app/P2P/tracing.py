@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import random
+import threading
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+SpanContext = namedtuple("SpanContext", ["trace_id", "span_id", "parent_id"])
+
+
+def format_trace(span):
+    """
+    Returns the wire field carrying the trace context of a message.
+
+    :param span: The span to propagate, or None if the message is not sampled.
+    :type span: Union[SpanContext, None]
+    :return: The ``, trace=<trace_id>:<span_id>`` field, or an empty string for unsampled messages.
+    :rtype: str
+    """
+    if span is None:
+        return ""
+    return f", trace={span.trace_id}:{span.span_id}"
+
+
+def parse_trace(message):
+    """
+    Extracts the trace context carried in a message.
+
+    :param message: The message payload, as comma separated fields.
+    :type message: str
+    :return: A span context whose ``span_id`` is the sender's span, or None if the message is not sampled.
+    :rtype: Union[SpanContext, None]
+    """
+    for field in message.split(",")[1:]:
+        field = field.strip()
+        if field.startswith("trace="):
+            trace_id, span_id = field[len("trace="):].split(":")
+            return SpanContext(trace_id, span_id, None)
+    return None
+
+
+class Tracer:
+    """
+    Records message hops into an in-memory ring buffer and periodically exports them as Chrome trace files.
+
+    Sampling is decided once, when a trace is started; every hop of a sampled message carries its trace context so
+    the propagation tree of a broadcast can be rebuilt from the ``parent_id`` of its spans. Recording is a single
+    ``deque.append``, which is atomic in CPython, so the hot path takes no lock and does no I/O; when the buffer is
+    full the oldest events are dropped.
+
+    :param name: The name of the traced process, used as the Chrome trace process name.
+    :type name: str
+    :param sample_rate: The fraction of traces that are recorded, between 0 and 1 (default is 0.0).
+    :type sample_rate: float
+    :param capacity: The maximum number of buffered events (default is 65536).
+    :type capacity: int
+    :param export_dir: The directory the trace files are written to (default is "traces").
+    :type export_dir: str
+    :param export_interval: The number of seconds between two exports (default is 1.0).
+    :type export_interval: float
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sample_rate: float = 0.0,
+        capacity: int = 65536,
+        export_dir: str = "traces",
+        export_interval: float = 1.0,
+    ):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.export_dir = export_dir
+        self.export_interval = export_interval
+        self.events = deque(maxlen=capacity)
+        self.exports = 0
+        # Keeps the files of a restarted process from overwriting those of its previous run
+        self.run_id = os.urandom(4).hex()
+        self._random = random.Random()
+        self._stopped = threading.Event()
+        self._exporter = None
+
+    def start_trace(self):
+        """
+        Starts a new trace, subject to sampling.
+
+        :return: The root span of the trace, or None if the trace is not sampled.
+        :rtype: Union[SpanContext, None]
+        """
+        if self.sample_rate <= 0 or self._random.random() >= self.sample_rate:
+            return None
+        return SpanContext(self._new_id(), self._new_id(), None)
+
+    def start_span(self, parent):
+        """
+        Starts a child span of the specified span.
+
+        :param parent: The parent span, or None if the trace is not sampled.
+        :type parent: Union[SpanContext, None]
+        :return: The new span, or None if the trace is not sampled.
+        :rtype: Union[SpanContext, None]
+        """
+        if parent is None:
+            return None
+        return SpanContext(parent.trace_id, self._new_id(), parent.span_id)
+
+    def record(self, name: str, span: SpanContext, start: float, end: float, **args):
+        """
+        Records a finished span. Does nothing if the span is not sampled.
+
+        :param name: The name of the event, e.g. "send" or "receive".
+        :type name: str
+        :param span: The span the event belongs to.
+        :type span: Union[SpanContext, None]
+        :param start: The start time of the event, in seconds since the epoch.
+        :type start: float
+        :param end: The end time of the event, in seconds since the epoch.
+        :type end: float
+        """
+        if span is not None:
+            self.events.append((name, span, start, end, threading.get_ident(), args))
+
+    def drain(self) -> list:
+        """
+        Removes and returns all buffered events as Chrome trace events.
+
+        :return: A list of Chrome trace "complete" events.
+        :rtype: list
+        """
+        events = []
+        while True:
+            try:
+                name, span, start, end, tid, args = self.events.popleft()
+            except IndexError:
+                break
+            events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": self.name,
+                    "tid": tid,
+                    "args": dict(
+                        args,
+                        trace_id=span.trace_id,
+                        span_id=span.span_id,
+                        parent_id=span.parent_id,
+                    ),
+                }
+            )
+        return events
+
+    def export(self):
+        """
+        Writes all buffered events to a new Chrome trace file, named after the process, its run and the export count.
+
+        :return: The path of the written file, or None if there was nothing to export.
+        :rtype: Union[str, None]
+        """
+        events = self.drain()
+        if not events:
+            return None
+        os.makedirs(self.export_dir, exist_ok=True)
+        file_name = f"trace-{self.name.replace(':', '-')}-{self.run_id}-{self.exports}.json"
+        path = os.path.join(self.export_dir, file_name)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        self.exports += 1
+        return path
+
+    def start(self) -> None:
+        """
+        Starts the background exporter thread.
+
+        The exporter runs whatever the local sample rate is, since sampling is decided by the node that starts a
+        trace and every node on its path records spans for it.
+        """
+        if self._exporter is not None:
+            return
+        self._exporter = threading.Thread(target=self._export_loop, daemon=True)
+        self._exporter.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background exporter thread and exports the remaining events.
+        """
+        self._stopped.set()
+        if self._exporter is not None:
+            self._exporter.join()
+            self._exporter = None
+
+    def _new_id(self):
+        return f"{self._random.getrandbits(64):016x}"
+
+    def _export_loop(self):
+        while not self._stopped.wait(self.export_interval):
+            self._export()
+        self._export()
+
+    def _export(self):
+        try:
+            self.export()
+        except OSError as e:
+            logger.error(f"Error exporting traces for {self.name}: {e}")
@@ -0,0 +1,51 @@
+import unittest
+
+from p2p.failure_detector import PhiAccrualFailureDetector
+
+
+class TestPhiAccrualFailureDetector(unittest.TestCase):
+    def test_unknown_peer_is_available(self):
+        detector = PhiAccrualFailureDetector()
+        self.assertEqual(detector.phi(("127.0.0.1", 6001), now=100.0), 0.0)
+        self.assertTrue(detector.is_available(("127.0.0.1", 6001), now=100.0))
+
+    def test_phi_grows_with_missed_heartbeats(self):
+        detector = PhiAccrualFailureDetector(threshold=8.0)
+        peer = ("127.0.0.1", 6001)
+        for i in range(10):
+            detector.heartbeat(peer, now=float(i))
+
+        self.assertTrue(detector.is_available(peer, now=10.0))
+        self.assertLess(detector.phi(peer, now=10.0), detector.phi(peer, now=12.0))
+        self.assertFalse(detector.is_available(peer, now=20.0))
+
+    def test_seen_delays_suspicion_without_learning_intervals(self):
+        detector = PhiAccrualFailureDetector(threshold=8.0)
+        peer = ("127.0.0.1", 6001)
+        for i in range(10):
+            detector.heartbeat(peer, now=float(i))
+        # A burst of other traffic must not teach the detector that the peer is chatty
+        for i in range(100):
+            detector.seen(peer, now=9.5 + i / 1000)
+
+        self.assertGreater(detector.phi(peer, now=12.0), detector.threshold)
+        self.assertLess(detector.phi(peer, now=10.5), 1.0)
+
+    def test_acceptable_heartbeat_pause(self):
+        detector = PhiAccrualFailureDetector(threshold=8.0, acceptable_heartbeat_pause=3.0)
+        peer = ("127.0.0.1", 6001)
+        for i in range(10):
+            detector.heartbeat(peer, now=float(i))
+        self.assertTrue(detector.is_available(peer, now=12.0))
+        self.assertFalse(detector.is_available(peer, now=16.0))
+
+    def test_remove_forgets_peer(self):
+        detector = PhiAccrualFailureDetector()
+        peer = ("127.0.0.1", 6001)
+        detector.heartbeat(peer, now=0.0)
+        detector.remove(peer)
+        self.assertEqual(detector.phi(peer, now=100.0), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from hypergraph.graph import Graph
+from p2p.network import Peer
+from p2p.reliable import SendWindow
+
+IP = "127.0.0.1"
+
+export_dir = tempfile.TemporaryDirectory()
+
+
+def tearDownModule():
+    export_dir.cleanup()
+
+
+def start_peer(port, **kwargs):
+    peer = Peer(IP, port, [], **kwargs)
+    peer.tracer.export_dir = export_dir.name
+    threading.Thread(target=peer.start, daemon=True).start()
+    wait_for(lambda: peer.socket.getsockname()[1] == port)
+    return peer
+
+
+def black_hole(port):
+    # A listener whose backlog is full drops new SYNs, so connecting to it hangs
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind((IP, port))
+    server.listen(0)
+    clients = []
+    for _ in range(3):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.setblocking(False)
+        try:
+            client.connect((IP, port))
+        except BlockingIOError:
+            pass
+        clients.append(client)
+    time.sleep(0.1)
+    return [server] + clients
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestPeerFailureDetection(unittest.TestCase):
+    def test_stop_ends_start(self):
+        # setup runs start() on non-daemon threads, they must finish for the process to exit
+        peer = Peer(IP, 7403, [])
+        thread = threading.Thread(target=peer.start)
+        thread.start()
+        wait_for(lambda: peer.socket.getsockname()[1] == 7403)
+
+        peer.stop()
+        thread.join(timeout=2)
+        self.assertFalse(thread.is_alive())
+
+    def test_connect_is_bounded_by_timeout(self):
+        sockets = black_hole(7402)
+        try:
+            peer = Peer(IP, 7401, [], connect_timeout=0.2)
+            start_time = time.time()
+            peer.connect(IP, 7402)
+            self.assertLess(time.time() - start_time, 1.0)
+            self.assertEqual(peer.peers, [])
+        finally:
+            for s in sockets:
+                s.close()
+
+    def test_suspected_peer_is_removed(self):
+        graph = Graph(nodes=[f"{IP}:7411", f"{IP}:7412"], edges=[({f"{IP}:7411", f"{IP}:7412"}, 1)])
+        node = start_peer(
+            7411, graph=graph, heartbeat_interval=0.1, connect_timeout=0.1, io_timeout=0.1
+        )
+        other = start_peer(7412, graph=graph, heartbeat_interval=0.1)
+        try:
+            node.connect(IP, 7412)
+            self.assertEqual(node.peers, [(IP, 7412)])
+
+            # A live peer is kept
+            time.sleep(0.5)
+            self.assertEqual(node.peers, [(IP, 7412)])
+
+            other.stop()
+            self.assertTrue(wait_for(lambda: not node.peers))
+            self.assertEqual(graph.get_nodes(), [f"{IP}:7411"])
+        finally:
+            node.stop()
+            other.stop()
+
+
+class TestPeerTracing(unittest.TestCase):
+    def test_trace_context_propagates(self):
+        # Only the broadcasting node samples, the others follow its decision
+        node = start_peer(7421, trace_sample_rate=1.0)
+        other = start_peer(7422)
+        try:
+            node.connect(IP, 7422)
+            node.send_message("Hello world!")
+            self.assertTrue(
+                wait_for(lambda: any(event[0] == "receive" for event in list(other.tracer.events)))
+            )
+            sends = [event for event in list(node.tracer.events) if event[0] == "send"]
+            receive = next(event for event in list(other.tracer.events) if event[0] == "receive")
+
+            self.assertEqual(len(sends), 1)
+            self.assertEqual(receive[1].trace_id, sends[0][1].trace_id)
+            self.assertEqual(receive[1].parent_id, sends[0][1].span_id)
+            self.assertIsNotNone(other.tracer._exporter)
+        finally:
+            node.stop()
+            other.stop()
+
+
+class TestPeerReliableDelivery(unittest.TestCase):
+    def test_message_is_acknowledged(self):
+        node = start_peer(7431)
+        other = start_peer(7432)
+        try:
+            node.connect(IP, 7432)
+            future = node.send_message("Hello world!")[(IP, 7432)]
+            self.assertEqual(future.result(timeout=5), 1)
+            self.assertEqual(other.messages_received, 2)
+        finally:
+            node.stop()
+            other.stop()
+
+    def test_failed_send_disarms_rest_of_batch(self):
+        # The peer accepts the first connection into its backlog, then the second connect fails
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind((IP, 7462))
+        server.listen()
+        node = Peer(IP, 7461, [(IP, 7462)])
+        window = SendWindow((IP, 7462))
+        for i in range(3):
+            window.submit((f"m{i}", 1.0, "origin", None, "send"))
+        connect_socket = node._connect_socket
+        connects = []
+
+        def failing_connect_socket(peer_socket, peer):
+            connects.append(peer)
+            if len(connects) == 2:
+                raise ConnectionRefusedError("refused")
+            connect_socket(peer_socket, peer)
+
+        node._connect_socket = failing_connect_socket
+        try:
+            self.assertFalse(node._transmit((IP, 7462), window))
+        finally:
+            node.socket.close()
+            server.close()
+
+        # Message 2 was attempted and waits for its timer, message 3 never left and is sendable again
+        self.assertEqual([entry.attempts for entry in window.outstanding.values()], [1, 1, 0])
+        self.assertEqual([(seq, attempt) for seq, _, _, attempt in window.sendable()], [(3, 1)])
+
+    def test_readded_peer_starts_new_session(self):
+        node = start_peer(7441)
+        other = start_peer(7442)
+        try:
+            node.connect(IP, 7442)
+            for i in range(3):
+                node.send_message(f"m{i}")[(IP, 7442)].result(timeout=5)
+
+            node.remove_peer((IP, 7442))
+            node.connect(IP, 7442)
+            self.assertEqual(node.send_message("m3")[(IP, 7442)].result(timeout=5), 1)
+            # Received for real, not dropped as a duplicate of the previous session's first message
+            self.assertTrue(wait_for(lambda: other.messages_received == 6))
+        finally:
+            node.stop()
+            other.stop()
+
+    def test_broadcast_terminates(self):
+        nodes = [start_peer(port) for port in (7451, 7452, 7453)]
+
+        def counters():
+            return [(node.messages_received, node.messages_sent) for node in nodes]
+
+        def idle():
+            # Nothing left to acknowledge and no message still travelling
+            before = counters()
+            time.sleep(0.2)
+            return before == counters() and all(
+                not window.outstanding for node in nodes for window in list(node.send_windows.values())
+            )
+
+        try:
+            for node in nodes:
+                for other in nodes:
+                    if other is not node:
+                        node.connect(other.ip, other.port)
+            self.assertTrue(wait_for(idle))
+            received = [node.messages_received for node in nodes]
+            sent = [node.messages_sent for node in nodes]
+
+            futures = nodes[0].send_message("Hello world!")
+            for future in futures.values():
+                future.result(timeout=5)
+            self.assertTrue(wait_for(idle))
+
+            # Each node delivers the broadcast once and forwards it to everyone but the peer it came from
+            self.assertEqual([node.messages_received - r for node, r in zip(nodes, received)], [0, 1, 1])
+            self.assertEqual([node.messages_sent - s for node, s in zip(nodes, sent)], [2, 1, 1])
+        finally:
+            for node in nodes:
+                node.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+
+from p2p._exceptions import DeliveryError
+from p2p.reliable import (
+    ReceiveWindow,
+    SendWindow,
+    broadcast_id,
+    format_ack,
+    format_origin,
+    format_sequence,
+    parse_ack,
+    parse_origin,
+    parse_sequence,
+)
+
+PEER = ("127.0.0.1", 6002)
+
+
+class TestSendWindow(unittest.TestCase):
+    def test_window_limits_messages_in_flight(self):
+        window = SendWindow(PEER, window_size=2)
+        futures = [window.submit(f"m{i}") for i in range(3)]
+
+        sent = window.sendable(now=0.0)
+        self.assertEqual([(seq, data) for seq, _, data, _ in sent], [(1, "m0"), (2, "m1")])
+
+        window.on_ack(1, set(), now=0.1)
+        self.assertEqual(futures[0].result(timeout=0), 1)
+        self.assertEqual([seq for seq, *_ in window.sendable(now=0.1)], [3])
+
+    def test_selective_ack_skips_retransmission(self):
+        window = SendWindow(PEER, initial_rto=1.0)
+        futures = [window.submit(i) for i in range(3)]
+        window.sendable(now=0.0)
+
+        window.on_ack(0, {2, 3}, now=0.1)
+        self.assertTrue(futures[1].done())
+        self.assertTrue(futures[2].done())
+        self.assertFalse(futures[0].done())
+
+        self.assertEqual(window.sendable(now=0.5), [])
+        self.assertEqual([(seq, attempt) for seq, _, _, attempt in window.sendable(now=1.0)], [(1, 2)])
+
+    def test_fast_retransmit(self):
+        window = SendWindow(PEER, initial_rto=10.0)
+        for i in range(5):
+            window.submit(i)
+        window.sendable(now=0.0)
+
+        for seq in (2, 3, 4):
+            window.on_ack(0, {seq}, now=0.1)
+        self.assertEqual([seq for seq, *_ in window.sendable(now=0.1)], [1])
+
+    def test_disarm_unsent_messages(self):
+        window = SendWindow(PEER, initial_rto=1.0)
+        for i in range(3):
+            window.submit(i)
+        window.sendable(now=0.0)
+        self.assertEqual(window.sendable(now=0.1), [])
+
+        # Sending 2 failed, so 3 never left
+        window.disarm([3])
+        self.assertEqual([(seq, attempt) for seq, _, _, attempt in window.sendable(now=0.1)], [(3, 1)])
+        self.assertEqual([(seq, attempt) for seq, _, _, attempt in window.sendable(now=1.0)], [(1, 2), (2, 2)])
+
+    def test_abandon_after_max_retransmits(self):
+        window = SendWindow(PEER, initial_rto=1.0, max_rto=1.0, max_retransmits=1)
+        future = window.submit("m")
+        window.sendable(now=0.0)
+        window.sendable(now=1.0)
+
+        self.assertEqual(window.sendable(now=2.0), [])
+        self.assertIsInstance(future.exception(timeout=0), DeliveryError)
+        self.assertEqual(window.base, 2)
+
+    def test_fail(self):
+        window = SendWindow(PEER)
+        future = window.submit("m")
+        window.fail("peer suspected to have failed")
+        self.assertIsInstance(future.exception(timeout=0), DeliveryError)
+
+        # The window is closed, nobody would ever flush or fail a later message
+        self.assertIsInstance(window.submit("m").exception(timeout=0), DeliveryError)
+        self.assertEqual(window.outstanding, {})
+
+    def test_submit_fails_when_queue_full(self):
+        window = SendWindow(PEER, max_queued=2)
+        window.submit("m0")
+        window.submit("m1")
+        error = window.submit("m2").exception(timeout=0)
+        self.assertIsInstance(error, DeliveryError)
+        self.assertIsNone(error.seq)
+        self.assertEqual(len(window.outstanding), 2)
+
+    def test_new_window_has_new_incarnation(self):
+        self.assertNotEqual(SendWindow(PEER).incarnation, SendWindow(PEER).incarnation)
+
+
+class TestReceiveWindow(unittest.TestCase):
+    def test_duplicates_and_acks(self):
+        window = ReceiveWindow("00000000")
+        self.assertTrue(window.on_data(1, 1))
+        self.assertTrue(window.on_data(3, 1))
+        self.assertFalse(window.on_data(3, 1))
+        self.assertEqual(window.ack(), (1, [3]))
+
+        self.assertTrue(window.on_data(2, 1))
+        self.assertFalse(window.on_data(1, 1))
+        self.assertEqual(window.ack(), (3, []))
+
+    def test_base_skips_abandoned_messages(self):
+        window = ReceiveWindow("00000000")
+        window.on_data(3, 1)
+        self.assertTrue(window.on_data(4, 3))
+        self.assertEqual(window.ack(), (4, []))
+
+
+class TestWireFormat(unittest.TestCase):
+    def test_sequence_round_trip(self):
+        message = f"Hello world!{format_sequence('127.0.0.1', 6001, 'ab12cd34', 5, 2)}, timestamp=1.0"
+        self.assertEqual(parse_sequence(message), (("127.0.0.1", 6001), "ab12cd34", 5, 2))
+        self.assertIsNone(parse_sequence("Hello world!, timestamp=1.0"))
+
+    def test_origin_round_trip(self):
+        origin = broadcast_id("127.0.0.1", 6001, "ab12cd34", 7)
+        message = f"Hello world!{format_origin(origin)}, timestamp=1.0"
+        self.assertEqual(parse_origin(message), "127.0.0.1:6001:ab12cd34:7")
+        self.assertIsNone(parse_origin("Hello world!, timestamp=1.0"))
+
+    def test_ack_round_trip(self):
+        self.assertEqual(
+            parse_ack(format_ack("127.0.0.1", 6002, "ab12cd34", 3, [5, 7])), (PEER, "ab12cd34", 3, {5, 7})
+        )
+        self.assertEqual(
+            parse_ack(format_ack("127.0.0.1", 6002, "ab12cd34", 3, [])), (PEER, "ab12cd34", 3, set())
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+import unittest
+
+from p2p.tracing import Tracer, format_trace, parse_trace
+
+
+class TestTracing(unittest.TestCase):
+    def test_trace_round_trip(self):
+        tracer = Tracer("127.0.0.1:6001", sample_rate=1.0)
+        span = tracer.start_span(tracer.start_trace())
+        message = f"Hello world!{format_trace(span)}, timestamp=1.0"
+
+        parent = parse_trace(message)
+        self.assertEqual(parent.trace_id, span.trace_id)
+        self.assertEqual(parent.span_id, span.span_id)
+        self.assertEqual(float(message.split(",")[-1].split("=")[-1]), 1.0)
+        self.assertEqual(message.split(",")[0], "Hello world!")
+
+    def test_unsampled_trace(self):
+        tracer = Tracer("127.0.0.1:6001", sample_rate=0.0)
+        span = tracer.start_trace()
+        self.assertIsNone(span)
+        self.assertIsNone(tracer.start_span(span))
+        self.assertEqual(format_trace(span), "")
+        self.assertIsNone(parse_trace("Hello world!, timestamp=1.0"))
+
+        tracer.record("send", span, 0.0, 1.0)
+        self.assertEqual(len(tracer.events), 0)
+
+    def test_ring_buffer_drops_oldest(self):
+        tracer = Tracer("127.0.0.1:6001", sample_rate=1.0, capacity=2)
+        span = tracer.start_trace()
+        for i in range(3):
+            tracer.record(f"hop{i}", span, float(i), float(i + 1))
+
+        events = tracer.drain()
+        self.assertEqual([event["name"] for event in events], ["hop1", "hop2"])
+        self.assertEqual(tracer.drain(), [])
+
+    def test_export_chrome_trace(self):
+        with tempfile.TemporaryDirectory() as export_dir:
+            tracer = Tracer("127.0.0.1:6001", sample_rate=1.0, export_dir=export_dir)
+            self.assertIsNone(tracer.export())
+
+            root = tracer.start_trace()
+            hop = tracer.start_span(root)
+            tracer.record("send", hop, 1.0, 1.5, peer="127.0.0.1:6002")
+            path = tracer.export()
+
+            self.assertTrue(os.path.exists(path))
+            with open(path) as f:
+                event = json.load(f)["traceEvents"][0]
+            self.assertEqual(event["ph"], "X")
+            self.assertEqual(event["ts"], 1e6)
+            self.assertEqual(event["dur"], 0.5e6)
+            self.assertEqual(event["args"]["parent_id"], root.span_id)
+            self.assertEqual(event["args"]["peer"], "127.0.0.1:6002")
+
+    def test_restarted_tracer_keeps_previous_exports(self):
+        with tempfile.TemporaryDirectory() as export_dir:
+            paths = []
+            for _ in range(2):
+                tracer = Tracer("127.0.0.1:6001", sample_rate=1.0, export_dir=export_dir)
+                tracer.record("send", tracer.start_trace(), 1.0, 1.5)
+                paths.append(tracer.export())
+
+            self.assertNotEqual(paths[0], paths[1])
+            self.assertEqual(len(os.listdir(export_dir)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
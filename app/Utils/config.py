@@ -1,3 +1,21 @@
 IP_ADDRESS_PREFIX = "127.0.0.1"
 IP_ADDRESS_START_PORT = 6001
 NUM_NODES = 3
+SOCKET_CONNECT_TIMEOUT = 1.0
+SOCKET_IO_TIMEOUT = 2.0
+HEARTBEAT_INTERVAL = 1.0
+PHI_THRESHOLD = 8.0
+TRACE_SAMPLE_RATE = 0.0
+TRACE_BUFFER_SIZE = 65536
+TRACE_EXPORT_DIR = "traces"
+TRACE_EXPORT_INTERVAL = 1.0
+ACK_WINDOW_SIZE = 64
+RETRANSMIT_TIMEOUT = 1.0
+MIN_RETRANSMIT_TIMEOUT = 0.2
+MAX_RETRANSMIT_TIMEOUT = 10.0
+MAX_RETRANSMITS = 8
+RETRANSMIT_INTERVAL = 0.05
+MAX_SELECTIVE_ACKS = 32
+PEER_IO_WORKERS = 16
+SEND_QUEUE_SIZE = 1024
+SEEN_BROADCASTS = 4096